@@ -0,0 +1,211 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import stunextract
+
+# Non-interactive analysis of many captures: files (or byte-range shards of
+# very large files) are spread over a process pool and the per-worker peer
+# tables are merged into one report. A file that cannot be read is listed
+# under "failed" in the report instead of aborting the whole batch.
+# Usage: python batch.py captures/ "archive/*.pcapng" --ip 192.168.1.10 --format csv -o report.csv
+
+EXTENSIONS = (".pcap", ".pcapng", ".cap")
+SHARD_SIZE = 256 << 20
+READ_ERRORS = (OSError, ValueError, struct.error)
+
+
+def find_captures(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [os.path.join(item, name) for name in sorted(os.listdir(item))
+                       if name.lower().endswith(EXTENSIONS)]
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+        paths.extend(p for p in matches if os.path.isfile(p))
+    return list(dict.fromkeys(paths))
+
+
+def make_tasks(paths, shard_size=SHARD_SIZE):
+    # one task per file, or one per shard when the file is larger than shard_size
+    tasks = []
+    for path in paths:
+        try:
+            if os.path.getsize(path) > shard_size:
+                tasks.extend((path, shard) for shard in stunextract.plan_shards(path, shard_size))
+                continue
+        except READ_ERRORS:
+            pass
+        # unreadable files become a whole-file task so analyse() reports the error
+        tasks.append((path, None))
+    return tasks
+
+
+def analyse(task, own_ips=()):
+    # peer table of one task, or {"path": path, "error": reason} if it cannot be read
+    try:
+        return _analyse(task, own_ips)
+    except READ_ERRORS as e:
+        return {"path": task[0], "error": f"{type(e).__name__}: {e}"}
+
+
+def _analyse(task, own_ips):
+    # peer table of one task: {(src, dst): [requests, first_seen, last_seen, attrs]}
+    path, shard = task
+    packets = stun = 0
+    peers = {}
+    source = stunextract.read_packets(path) if shard is None else stunextract.read_shard(path, shard)
+    for ts, linktype, frame in source:
+        packets += 1
+        decoded = stunextract.decode_frame(linktype, frame)
+        if decoded is None:
+            continue
+        stun += 1
+        src, dst, _, _, msg_type, _, attrs = decoded
+        if stunextract.stun_method(msg_type) != stunextract.BINDING_METHOD or dst in own_ips:
+            continue
+        peer = peers.get((src, dst))
+        if peer is None:
+            peers[(src, dst)] = [1, ts, ts, set(attrs)]
+        else:
+            peer[0] += 1
+            peer[1] = min(peer[1], ts)
+            peer[2] = max(peer[2], ts)
+            peer[3].update(attrs)
+    size = os.path.getsize(path) if shard is None else shard[1] - shard[0]
+    return {"path": path, "bytes": size, "packets": packets, "stun": stun, "peers": peers}
+
+
+def merge(results):
+    report = {"files": set(), "failed": {}, "bytes": 0, "packets": 0, "stun_packets": 0, "peers": {}}
+    for result in results:
+        if "error" in result:
+            report["failed"].setdefault(result["path"], result["error"])
+            continue
+        report["files"].add(result["path"])
+        report["bytes"] += result["bytes"]
+        report["packets"] += result["packets"]
+        report["stun_packets"] += result["stun"]
+        for key, (count, first, last, attrs) in result["peers"].items():
+            peer = report["peers"].get(key)
+            if peer is None:
+                report["peers"][key] = [count, first, last, set(attrs), {result["path"]}]
+            else:
+                peer[0] += count
+                peer[1] = min(peer[1], first)
+                peer[2] = max(peer[2], last)
+                peer[3].update(attrs)
+                peer[4].add(result["path"])
+    return report
+
+
+def run(tasks, own_ips=(), workers=None):
+    if workers == 1:
+        return merge(analyse(task, own_ips) for task in tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return merge(pool.map(analyse, tasks, [own_ips] * len(tasks), chunksize=1))
+
+
+def peer_rows(report):
+    rows = []
+    for (src, dst), (count, first, last, attrs, files) in report["peers"].items():
+        rows.append({
+            "src": src,
+            "dst": dst,
+            "requests": count,
+            "first_seen": first,
+            "last_seen": last,
+            "attributes": stunextract.format_attrs(sorted(attrs)),
+            "files": sorted(files),
+        })
+    rows.sort(key=lambda row: (-row["requests"], row["dst"], row["src"]))
+    return rows
+
+
+CSV_FIELDS = ["src", "dst", "requests", "first_seen", "last_seen", "attributes", "files", "error"]
+
+
+def write_report(report, out, fmt):
+    rows = peer_rows(report)
+    failed = [{"path": path, "error": error} for path, error in sorted(report["failed"].items())]
+    if fmt == "csv":
+        # failed files are listed as rows with only files and error filled in
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, files=";".join(row["files"])))
+        for entry in failed:
+            writer.writerow({"files": entry["path"], "error": entry["error"]})
+    else:
+        json.dump({
+            "files": len(report["files"]),
+            "failed": failed,
+            "bytes": report["bytes"],
+            "packets": report["packets"],
+            "stun_packets": report["stun_packets"],
+            "peers": rows,
+        }, out, indent=2)
+        out.write("\n")
+
+
+def measure_scaling(tasks, own_ips):
+    # runs the same job with 1, 2, 4 ... cpu_count workers
+    counts = []
+    n = 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    counts.append(os.cpu_count() or 1)
+    base = None
+    print("workers\tseconds\tpkt/s\tMB/s\tspeedup", file=sys.stderr)
+    for workers in counts:
+        start = time.perf_counter()
+        report = run(tasks, own_ips, workers)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print(f"{workers}\t{elapsed:.3f}\t{report['packets'] / elapsed:.0f}\t"
+              f"{report['bytes'] / elapsed / 1e6:.1f}\t{base / elapsed:.2f}x", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find STUN peers across many captures")
+    parser.add_argument("inputs", nargs="+", help="capture files, directories or glob patterns")
+    parser.add_argument("--ip", action="append", default=[], help="own ip address to ignore as destination")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="split files larger than this many bytes")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("-o", "--output", help="report file (default stdout)")
+    parser.add_argument("--scaling", action="store_true", help="measure throughput against worker count")
+    args = parser.parse_args()
+
+    paths = find_captures(args.inputs)
+    if not paths:
+        parser.error("no capture files found")
+    tasks = make_tasks(paths, args.shard_size)
+    own_ips = frozenset(args.ip)
+    if args.scaling:
+        measure_scaling(tasks, own_ips)
+        return
+
+    start = time.perf_counter()
+    report = run(tasks, own_ips, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{len(paths)} files, {len(tasks)} tasks, {report['packets']} packets in {elapsed:.2f}s "
+          f"({report['packets'] / elapsed:.0f} pkt/s)", file=sys.stderr)
+    for path, error in sorted(report["failed"].items()):
+        print(f"failed: {path}: {error}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", newline="") as out:
+            write_report(report, out, args.format)
+    else:
+        write_report(report, sys.stdout, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import stunextract
+
+# Compares the in-process STUN extractor with the old three pass tshark chain.
+# Usage: python bench.py [capture.pcap] [own ip] [rounds]
+
+
+def tshark_chain(capture, ip_address, workdir):
+    binding = os.path.join(workdir, "packets1.pcap")
+    filtered = os.path.join(workdir, "filteredPackets.pcap")
+    subprocess.run(["tshark", "-Y", "stun.type.method==0x001", "-r", capture, "-w", binding],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    out = subprocess.run(["tshark", "-Y", f"ip.dst!={ip_address}", "-T", "fields", "-e", "ip.src",
+                          "-e", "ip.dst", "-e", "stun.attribute", "-r", binding, "-w", filtered],
+                         check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return sorted(set(out.stdout.decode().splitlines()))
+
+
+def best_of(rounds, func, *args):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    capture = sys.argv[1] if len(sys.argv) > 1 else "packets.pcap"
+    ip_address = sys.argv[2] if len(sys.argv) > 2 else "192.168.26.194"
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    packets = sum(1 for _ in stunextract.read_packets(capture))
+    size = os.path.getsize(capture)
+    print(f"{capture}: {packets} packets, {size} bytes, best of {rounds}\n")
+
+    elapsed, records = best_of(rounds, stunextract.extract_binding_requests, capture, ip_address)
+    print(f"native extractor : {elapsed * 1000:8.2f} ms  {packets / elapsed:10.0f} pkt/s  {len(records)} peers")
+
+    if shutil.which("tshark") is None:
+        print("tshark chain     : skipped (tshark not found in PATH)")
+        return
+    with tempfile.TemporaryDirectory() as workdir:
+        chain, lines = best_of(rounds, tshark_chain, capture, ip_address, workdir)
+    print(f"tshark chain     : {chain * 1000:8.2f} ms  {packets / chain:10.0f} pkt/s  {len(lines)} peers")
+    print(f"speedup          : {chain / elapsed:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import correlate
+import geolocate
+import geostub
+import stunextract
+import synthcap
+
+# Reproducible pipeline benchmark. Generates synthetic captures of the given
+# sizes (see synthcap.py), times each stage in a fresh process (parse,
+# filter, dedup, correlate, geolocate against the local geostub) and reports
+# packets/sec, peak RSS and latency percentiles. Results can be saved as a
+# baseline and later runs compared against it to catch regressions; each
+# stage keeps its best of --rounds runs (at least MIN_COMPARE_ROUNDS when
+# comparing, a single run is too noisy to flag a regression).
+# Usage: python benchsuite.py --calls 10 100 --save-baseline
+#        python benchsuite.py --calls 10 100 --compare
+
+BASELINE_FILE = "bench_baseline.json"
+SAMPLE_EVERY = 8
+MIN_COMPARE_SECONDS = 0.005
+MIN_COMPARE_ROUNDS = 3
+STAGES = ("parse", "filter", "dedup", "correlate", "geolocate")
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _timed_items(items, handle, every=SAMPLE_EVERY):
+    # runs handle(item) over items; returns (count, latencies in us of every
+    # Nth item, each covering producing and handling that single item)
+    clock = time.perf_counter
+    latencies = []
+    count = 0
+    start = None
+    for item in items:
+        handle(item)
+        count += 1
+        if start is not None:
+            latencies.append((clock() - start) * 1e6)
+            start = None
+        if count % every == 0:
+            start = clock()
+    return count, latencies
+
+
+def _filtered(path):
+    records = []
+    for ts, linktype, frame in stunextract.read_packets(path):
+        stun = stunextract.decode_frame(linktype, frame)
+        if stun is not None and stunextract.is_binding_to_peer(stun, None):
+            records.append((stun[0], stun[1], stunextract.format_attrs(stun[6])))
+    return records
+
+
+def run_stage(stage, path):
+    # executed in a fresh worker process so peak RSS belongs to this stage
+    start = time.perf_counter()
+    elapsed = None
+    if stage == "parse":
+        count, latencies = _timed_items(stunextract.read_packets(path), lambda packet: None)
+    elif stage == "filter":
+        records = []
+
+        def handle(packet):
+            stun = stunextract.decode_frame(packet[1], packet[2])
+            if stun is not None and stunextract.is_binding_to_peer(stun, None):
+                records.append((stun[0], stun[1], stunextract.format_attrs(stun[6])))
+        count, latencies = _timed_items(stunextract.read_packets(path), handle)
+    elif stage == "dedup":
+        records = _filtered(path)
+        start = time.perf_counter()
+        found = set()
+        count, latencies = _timed_items(records, found.add)
+        sorted(found)
+    elif stage == "correlate":
+        correlator = correlate.Correlator()
+        count, latencies = _timed_items(stunextract.read_packets(path),
+                                        lambda packet: correlator.feed_frame(*packet))
+        correlator.peers()
+    elif stage == "geolocate":
+        # private addresses never reach the network, so only public ones count
+        ips = [peer["ip"] for peer in correlate.rank_capture(path) if geolocate.is_public(peer["ip"])]
+        server, url = geostub.start()
+        try:
+            single = geolocate.OnlineLocator(url=url, cache=geolocate.GeoCache(None))
+            latencies = []
+            for ip in ips:
+                t = time.perf_counter()
+                single.lookup(ip)
+                latencies.append((time.perf_counter() - t) * 1e6)
+            batch = geolocate.OnlineLocator(url=url, cache=geolocate.GeoCache(None))
+            start = time.perf_counter()
+            batch.lookup_many(ips)
+            # timed before shutdown(), which waits out the serve_forever poll interval
+            elapsed = time.perf_counter() - start
+            count = len(ips)
+        finally:
+            server.shutdown()
+    else:
+        raise ValueError(f"unknown stage {stage}")
+    if elapsed is None:
+        elapsed = time.perf_counter() - start
+    result = {"items": count, "seconds": elapsed, "per_sec": count / elapsed if elapsed else None,
+              "peak_rss_mb": peak_rss_mb()}
+    result.update({f"{k}_us": v for k, v in percentiles(latencies).items()})
+    return result
+
+
+def run_suite(sizes, stages=STAGES, rounds=3, workdir=None, **options):
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for calls in sizes:
+            path = os.path.join(tmp, f"synthetic_{calls}.pcap")
+            synthcap.write(path, calls=calls, **options)
+            packets = sum(1 for _ in stunextract.read_packets(path))
+            key = f"calls={calls}"
+            results[key] = {"packets": packets, "bytes": os.path.getsize(path), "stages": {}}
+            for stage in stages:
+                best = None
+                for _ in range(rounds):
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        result = pool.submit(run_stage, stage, path).result()
+                    if best is None or result["seconds"] < best["seconds"]:
+                        best = result
+                results[key]["stages"][stage] = best
+    return results
+
+
+def print_results(results):
+    print("size\tstage\titems\titems/s\tp50 us\tp90 us\tp99 us\tpeak RSS MB")
+    for key, entry in results.items():
+        for stage, r in entry["stages"].items():
+            cells = [key, stage, r["items"], _fmt(r["per_sec"], "%.0f")]
+            cells += [_fmt(r[f"p{p}_us"], "%.2f") for p in (50, 90, 99)]
+            cells.append(_fmt(r["peak_rss_mb"], "%.1f"))
+            print("\t".join(str(c) for c in cells))
+
+
+def _fmt(value, pattern):
+    return "-" if value is None else pattern % value
+
+
+def compare(results, baseline, threshold):
+    # returns the list of stages whose throughput dropped by more than threshold
+    regressions = []
+    for key, entry in results.items():
+        for stage, r in entry["stages"].items():
+            old = baseline.get(key, {}).get("stages", {}).get(stage)
+            if not old or not old.get("per_sec") or not r["per_sec"]:
+                continue
+            if old["seconds"] < MIN_COMPARE_SECONDS:
+                print(f"{key}\t{stage}\ttoo short to compare")
+                continue
+            change = r["per_sec"] / old["per_sec"] - 1
+            flag = "REGRESSION" if change < -threshold else "ok"
+            print(f"{key}\t{stage}\t{old['per_sec']:.0f} -> {r['per_sec']:.0f}/s\t{change:+.1%}\t{flag}")
+            if change < -threshold:
+                regressions.append((key, stage, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vtrac pipeline on synthetic captures")
+    parser.add_argument("--calls", type=int, nargs="+", default=[10, 100], help="capture sizes in calls")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--turn-ratio", type=float, default=0.3)
+    parser.add_argument("--background-ratio", type=float, default=0.5)
+    parser.add_argument("--ipv6-ratio", type=float, default=0.2)
+    parser.add_argument("--media-packets", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare with the saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed throughput drop")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.compare and args.rounds < MIN_COMPARE_ROUNDS:
+        parser.error(f"--compare needs --rounds {MIN_COMPARE_ROUNDS} or more")
+
+    results = run_suite(args.calls, args.stages, args.rounds, turn_ratio=args.turn_ratio,
+                        background_ratio=args.background_ratio, ipv6_ratio=args.ipv6_ratio,
+                        media_packets=args.media_packets, seed=args.seed)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline saved to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
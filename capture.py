@@ -0,0 +1,192 @@
+import argparse
+import glob
+import os
+import struct
+import stunextract
+
+# Capture stage settings: a kernel BPF filter that keeps UDP packets carrying
+# the STUN magic cookie (plus RTP/TURN ChannelData-looking media and the
+# flows of already known peers), a headers-only snaplen, and size/time
+# rotated ring files. A fixed-duration scan keeps every ring file (the
+# files: limit would delete the start of the scan); only open-ended captures
+# keep the last RING_FILES of them. matches() evaluates the same expression in Python so
+# saved captures can be filtered offline to see how much I/O it saves.
+
+SNAPLEN = 256
+RING_FILESIZE_KB = 10240
+RING_DURATION = 60
+RING_FILES = 10
+
+COOKIE = 0x2112a442
+STUN_IPV4 = "udp[12:4] = 0x2112a442"
+STUN_IPV6 = "ip6[6] = 17 and ip6[52:4] = 0x2112a442"
+NON_MEDIA_PORTS = (53, 443)
+RTP_PAYLOAD_TYPES = ((0, 34), (96, 127))
+RTCP_PACKET_TYPES = (200, 206)
+
+
+def _media_expr(proto, udp):
+    # RTP version 2 with a static audio/video or dynamic payload type (or
+    # rtcp-mux RTCP), or TURN ChannelData whose length field matches the
+    # datagram; DNS and QUIC ports are never media. udp is the offset of the
+    # UDP header within proto[]
+    length, first, second = f"{proto}[{udp + 4}:2]", f"{proto}[{udp + 8}]", f"{proto}[{udp + 9}]"
+    types = " or ".join(f"({second} & 0x7f >= {lo} and {second} & 0x7f <= {hi})" if lo else f"{second} & 0x7f <= {hi}"
+                        for lo, hi in RTP_PAYLOAD_TYPES)
+    rtp = (f"{first} & 0xc0 = 0x80 and {length} >= 20 and ({types} or "
+           f"({second} >= {RTCP_PACKET_TYPES[0]} and {second} <= {RTCP_PACKET_TYPES[1]}))")
+    channel = f"{first} & 0xf0 = 0x40 and {length} - {proto}[{udp + 10}:2] - 12 <= 3"
+    ports = " and ".join(f"not port {port}" for port in NON_MEDIA_PORTS)
+    return f"{ports} and (({rtp}) or ({channel}))"
+
+
+MEDIA_IPV4 = _media_expr("udp", 0)
+MEDIA_IPV6 = "ip6[6] = 17 and " + _media_expr("ip6", 40)
+
+
+def stun_filter(peers=(), media=True):
+    # BPF expression; peers are ip strings or (ip, port) pairs whose flows are kept whole
+    terms = [f"(udp and {STUN_IPV4})", f"({STUN_IPV6})"]
+    if media:
+        terms += [f"(udp and ({MEDIA_IPV4}))", f"({MEDIA_IPV6})"]
+    for peer in peers:
+        if isinstance(peer, tuple):
+            terms.append(f"(udp and host {peer[0]} and port {peer[1]})")
+        else:
+            terms.append(f"(udp and host {peer})")
+    return " or ".join(terms)
+
+
+def matches(linktype, frame, peers=(), media=True):
+    # Python equivalent of stun_filter(peers, media) for offline reads
+    udp = stunextract.decode_udp(linktype, frame, sized=True)
+    if udp is None:
+        return False
+    src, dst, sport, dport, payload, size = udp
+    if len(payload) >= 8 and struct.unpack_from(">I", payload, 4)[0] == COOKIE:
+        return True
+    if media and is_media(sport, dport, payload, size):
+        return True
+    return any(_peer_match(peer, src, dst, sport, dport) for peer in peers)
+
+
+def is_media(sport, dport, payload, size):
+    # Python equivalent of _media_expr(); size is the untruncated payload size
+    if sport in NON_MEDIA_PORTS or dport in NON_MEDIA_PORTS or len(payload) < 4:
+        return False
+    if payload[0] & 0xc0 == 0x80:
+        payload_type = payload[1] & 0x7f
+        return size >= 12 and (any(lo <= payload_type <= hi for lo, hi in RTP_PAYLOAD_TYPES)
+                               or RTCP_PACKET_TYPES[0] <= payload[1] <= RTCP_PACKET_TYPES[1])
+    if payload[0] & 0xf0 == 0x40:
+        return 0 <= size - 4 - struct.unpack_from(">H", payload, 2)[0] <= 3
+    return False
+
+
+def _peer_match(peer, src, dst, sport, dport):
+    if isinstance(peer, tuple):
+        return peer[0] in (src, dst) and peer[1] in (sport, dport)
+    return peer in (src, dst)
+
+
+def capture_command(interface, outfile, duration=None, bpf=None, snaplen=SNAPLEN,
+                    ring_filesize_kb=RING_FILESIZE_KB, ring_duration=RING_DURATION, ring_files=RING_FILES):
+    cmd = ["tshark", "-i", interface, "-q", "-w", outfile]
+    if bpf:
+        cmd += ["-f", bpf]
+    if snaplen:
+        cmd += ["-s", str(snaplen)]
+    if duration:
+        cmd += ["-a", f"duration:{duration}"]
+    if ring_filesize_kb:
+        cmd += ["-b", f"filesize:{ring_filesize_kb}"]
+    if ring_duration:
+        cmd += ["-b", f"duration:{ring_duration}"]
+    if ring_files and not duration and (ring_filesize_kb or ring_duration):
+        cmd += ["-b", f"files:{ring_files}"]
+    return cmd
+
+
+def ring_files(outfile):
+    # files written by a rotating capture, oldest first (tshark names them
+    # <stem>_<nnnnn>_<timestamp><ext>); falls back to outfile itself
+    stem, ext = os.path.splitext(outfile)
+    files = sorted(glob.glob(f"{glob.escape(stem)}_[0-9][0-9][0-9][0-9][0-9]_*{ext}"))
+    if not files and os.path.exists(outfile):
+        files = [outfile]
+    return files
+
+
+def lost_ring_files(files):
+    # how many of the oldest ring files tshark already deleted, from the
+    # sequence number of the first one left
+    if not files:
+        return 0
+    name = os.path.basename(files[0])
+    stem, _ = os.path.splitext(name)
+    parts = stem.rsplit("_", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return 0
+    return int(parts[1]) - 1
+
+
+def write_pcap(path, packets, snaplen=SNAPLEN):
+    # classic microsecond pcap with the link type of the first frame; returns bytes written
+    written = 0
+    with open(path, "wb") as f:
+        linktype = None
+        for ts, frame_linktype, frame in packets:
+            if linktype is None:
+                linktype = frame_linktype
+                f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, snaplen or 262144, linktype))
+                written += 24
+            if frame_linktype != linktype:
+                continue
+            sec = int(ts)
+            data = frame[:snaplen] if snaplen else frame
+            f.write(struct.pack("<IIII", sec, int(round((ts - sec) * 1000000)) % 1000000, len(data), len(frame)))
+            f.write(data)
+            written += 16 + len(data)
+        if linktype is None:
+            f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, snaplen or 262144,
+                                stunextract.LINKTYPE_ETHERNET))
+            written += 24
+    return written
+
+
+def filter_capture(source, dest, peers=(), media=True, snaplen=SNAPLEN):
+    # applies the capture-time filter and snaplen to a saved capture
+    counts = {"packets": 0, "kept": 0, "in_bytes": 0}
+
+    def kept():
+        for ts, linktype, frame in stunextract.read_packets(source):
+            counts["packets"] += 1
+            counts["in_bytes"] += len(frame)
+            if matches(linktype, frame, peers, media):
+                counts["kept"] += 1
+                yield ts, linktype, frame
+    counts["out_bytes"] = write_pcap(dest, kept(), snaplen)
+    counts["file_bytes"] = os.path.getsize(source)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the capture-time STUN filter to saved captures")
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("--peer", action="append", default=[], help="ip or ip:port whose flows are kept")
+    parser.add_argument("--no-media", action="store_true", help="keep STUN packets only")
+    parser.add_argument("--snaplen", type=int, default=SNAPLEN)
+    parser.add_argument("-o", "--outdir", default=".", help="where to write <name>.filtered.pcap")
+    args = parser.parse_args()
+    peers = [(p.rsplit(":", 1)[0], int(p.rsplit(":", 1)[1])) if p.count(":") == 1 else p for p in args.peer]
+    print("BPF:", stun_filter(peers, not args.no_media), "\n")
+    print("capture\tpackets\tkept\tfile bytes\tfiltered bytes\tsaved")
+    for path in args.captures:
+        dest = os.path.join(args.outdir, os.path.splitext(os.path.basename(path))[0] + ".filtered.pcap")
+        c = filter_capture(path, dest, peers, not args.no_media, args.snaplen)
+        saved = 1 - c["out_bytes"] / c["file_bytes"] if c["file_bytes"] else 0
+        print(f"{path}\t{c['packets']}\t{c['kept']}\t{c['file_bytes']}\t{c['out_bytes']}\t{saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
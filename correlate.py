@@ -0,0 +1,206 @@
+import collections
+import ipaddress
+import stunextract
+
+# Incremental STUN/media correlation. Binding requests open a flow on their
+# 5-tuple and are indexed by transaction id so responses can be matched;
+# every later UDP packet on that 5-tuple is counted as media. A flow is a
+# peer candidate when its requests carry ICE attributes or go to a port other
+# than the well-known STUN ports (an ICE connectivity check, answered or not);
+# requests to 3478/19302 without ICE attributes are STUN server queries.
+# Peers are then ranked by role, media volume and duration so the real call
+# partner comes before TURN relays, LAN candidates and plain STUN servers.
+# In a relayed call the media goes to the relay, so a peer candidate may
+# have no media of its own and still be the call partner.
+# Flows idle for longer than idle_timeout (capture time) are folded into
+# per-peer totals, and every table is size bounded, so memory stays flat on
+# multi-GB captures.
+
+IDLE_TIMEOUT = 60.0
+MAX_FLOWS = 65536
+MAX_TRANSACTIONS = 65536
+MAX_PEERS = 65536
+
+CLASS_REQUEST = 0x0000
+CLASS_SUCCESS = 0x0100
+CLASS_ERROR = 0x0110
+TURN_METHODS = {0x003, 0x004, 0x006, 0x007, 0x008, 0x009}
+STUN_SERVER_PORTS = {3478, 5349, 19302}
+ICE_ATTRIBUTES = {0x0024, 0x0025, 0x8029, 0x802a}
+
+ROLE_ORDER = {"peer": 0, "relay": 1, "lan": 2, "stun-server": 3}
+
+
+class Flow:
+    __slots__ = ("local", "remote", "first", "last", "packets", "bytes", "media_packets",
+                 "media_bytes", "requests", "responses", "rtt", "turn", "ice")
+
+    def __init__(self, local, remote, ts):
+        self.local = local
+        self.remote = remote
+        self.first = self.last = ts
+        self.packets = self.bytes = 0
+        self.media_packets = self.media_bytes = 0
+        self.requests = self.responses = 0
+        self.rtt = None
+        self.turn = False
+        self.ice = False
+
+
+def flow_key(src, sport, dst, dport):
+    a, b = (src, sport), (dst, dport)
+    return (a, b) if a <= b else (b, a)
+
+
+def is_lan(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_private or addr.is_link_local
+
+
+def is_channel_data(payload):
+    return len(payload) >= 4 and 0x40 <= payload[0] <= 0x4f
+
+
+class Correlator:
+    def __init__(self, own_ips=(), idle_timeout=IDLE_TIMEOUT, max_flows=MAX_FLOWS,
+                 max_transactions=MAX_TRANSACTIONS, max_peers=MAX_PEERS):
+        self.own_ips = frozenset(own_ips)
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.max_transactions = max_transactions
+        self.max_peers = max_peers
+        self.flows = collections.OrderedDict()
+        self.transactions = collections.OrderedDict()
+        self.totals = collections.OrderedDict()
+        self.next_sweep = None
+        self.evicted = 0
+
+    def feed(self, ts, src, dst, sport, dport, payload, size=None):
+        # size is the on-the-wire payload size when payload was cut by a snaplen
+        size = len(payload) if size is None else size
+        key = flow_key(src, sport, dst, dport)
+        flow = self.flows.get(key)
+        stun = stunextract.decode_stun(payload)
+        if stun is not None:
+            flow = self._stun(ts, key, flow, src, dst, sport, dport, stun)
+        if flow is None:
+            return
+        self.flows.move_to_end(key)
+        flow.last = ts
+        flow.packets += 1
+        flow.bytes += size
+        if stun is None:
+            flow.media_packets += 1
+            flow.media_bytes += size
+            if is_channel_data(payload):
+                flow.turn = True
+        if self.next_sweep is None or ts >= self.next_sweep:
+            self.sweep(ts)
+
+    def feed_frame(self, ts, linktype, frame):
+        udp = stunextract.decode_udp(linktype, frame, sized=True)
+        if udp is not None:
+            self.feed(ts, *udp)
+
+    def _stun(self, ts, key, flow, src, dst, sport, dport, stun):
+        msg_type, txid, attrs = stun
+        method = stunextract.stun_method(msg_type)
+        cls = msg_type & 0x0110
+        if flow is None:
+            if cls != CLASS_REQUEST:
+                return None
+            if dst in self.own_ips and src not in self.own_ips:
+                local, remote = (dst, dport), (src, sport)
+            else:
+                local, remote = (src, sport), (dst, dport)
+            flow = self.flows[key] = Flow(local, remote, ts)
+            if len(self.flows) > self.max_flows:
+                self._evict(*self.flows.popitem(last=False))
+        if method in TURN_METHODS:
+            flow.turn = True
+        if cls == CLASS_REQUEST:
+            flow.requests += 1
+            if not flow.ice and ICE_ATTRIBUTES.intersection(attrs):
+                flow.ice = True
+            self.transactions[txid] = (ts, key)
+            if len(self.transactions) > self.max_transactions:
+                self.transactions.popitem(last=False)
+        elif cls in (CLASS_SUCCESS, CLASS_ERROR):
+            request = self.transactions.pop(txid, None)
+            if request is not None and request[1] == key:
+                flow.responses += 1
+                if flow.rtt is None:
+                    flow.rtt = ts - request[0]
+        return flow
+
+    def sweep(self, now):
+        # evicts flows and transactions idle for longer than idle_timeout
+        cutoff = now - self.idle_timeout
+        while self.flows:
+            key, flow = next(iter(self.flows.items()))
+            if flow.last >= cutoff:
+                break
+            del self.flows[key]
+            self._evict(key, flow)
+        while self.transactions:
+            txid, (ts, _) = next(iter(self.transactions.items()))
+            if ts >= cutoff:
+                break
+            del self.transactions[txid]
+        self.next_sweep = now + self.idle_timeout / 4
+
+    def _evict(self, key, flow):
+        self.evicted += 1
+        _add_flow(self.totals, flow)
+        self.totals.move_to_end(flow.remote[0])
+        while len(self.totals) > self.max_peers:
+            self.totals.popitem(last=False)
+
+    def peers(self):
+        # ranked peer summaries, most likely call partner first
+        totals = {ip: dict(peer, ports=set(peer["ports"])) for ip, peer in self.totals.items()}
+        for flow in self.flows.values():
+            _add_flow(totals, flow)
+        ranked = []
+        for ip, peer in totals.items():
+            if peer["turn"]:
+                role = "relay"
+            elif is_lan(ip):
+                role = "lan"
+            elif peer["candidate"]:
+                role = "peer"
+            else:
+                role = "stun-server"
+            peer = dict(peer, ip=ip, role=role, duration=peer["last"] - peer["first"], ports=sorted(peer["ports"]))
+            ranked.append(peer)
+        ranked.sort(key=lambda p: (ROLE_ORDER[p["role"]], -p["media_bytes"], -p["media_packets"],
+                                   -p["duration"], -p["packets"], p["ip"]))
+        return ranked
+
+
+def _add_flow(totals, flow):
+    ip = flow.remote[0]
+    peer = totals.get(ip)
+    if peer is None:
+        peer = totals[ip] = {"packets": 0, "bytes": 0, "media_packets": 0, "media_bytes": 0,
+                             "requests": 0, "responses": 0, "first": flow.first, "last": flow.last,
+                             "rtt": None, "turn": False, "candidate": False, "ports": set()}
+    for field in ("packets", "bytes", "media_packets", "media_bytes", "requests", "responses"):
+        peer[field] += getattr(flow, field)
+    peer["first"] = min(peer["first"], flow.first)
+    peer["last"] = max(peer["last"], flow.last)
+    if flow.rtt is not None and (peer["rtt"] is None or flow.rtt < peer["rtt"]):
+        peer["rtt"] = flow.rtt
+    peer["turn"] = peer["turn"] or flow.turn
+    peer["candidate"] = peer["candidate"] or flow.ice or flow.remote[1] not in STUN_SERVER_PORTS
+    peer["ports"].add(flow.remote[1])
+
+
+def rank_capture(source, own_ip=None, **kwargs):
+    correlator = Correlator([own_ip] if own_ip else (), **kwargs)
+    for ts, linktype, frame in stunextract.read_packets(source):
+        correlator.feed_frame(ts, linktype, frame)
+    return correlator.peers()
@@ -0,0 +1,183 @@
+import ipaddress
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+# Geolocation lookups for found peers: one pooled session, a bounded number
+# of concurrent requests and a persistent on-disk cache keyed by ip.
+# Set VTRAC_GEO_URL (e.g. http://127.0.0.1:8080/{ip}/json/) to use a local
+# stand-in such as geostub.py instead of ipapi.co.
+# VTRAC_GEO_PROVIDER picks the provider: "online" (ipapi) or "offline"
+# (CSV ip-range database, see geooffline.py).
+
+GEO_PROVIDER = os.environ.get("VTRAC_GEO_PROVIDER", "online")
+GEO_URL = os.environ.get("VTRAC_GEO_URL", "https://ipapi.co/{ip}/json/")
+TIMEOUT = 5
+RETRIES = 3
+MAX_WORKERS = 8
+CACHE_FILE = "geocache.json"
+CACHE_TTL = 7 * 24 * 3600
+CACHE_SIZE = 10000
+
+FIELDS = {
+    "city": "city",
+    "region": "region",
+    "country": "country_name",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "country_area": "country_area",
+    "timezone": "timezone",
+    "country_calling_code": "country_calling_code",
+    "org": "org",
+}
+
+
+def is_public(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_global and not addr.is_multicast
+
+
+def location_from_response(ip, response):
+    location_data = {"ip": ip}
+    for field, key in FIELDS.items():
+        location_data[field] = response.get(key)
+    return location_data
+
+
+class GeoCache:
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL, max_entries=CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, ip):
+        # returns (found, location); entries are kept in least recently used order
+        with self.lock:
+            entry = self.entries.pop(ip, None)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self.misses += 1
+                metrics.inc("cache_misses")
+                return False, None
+            self.entries[ip] = entry
+            self.hits += 1
+            metrics.inc("cache_hits")
+            return True, entry[1]
+
+    def put(self, ip, location):
+        with self.lock:
+            self.entries.pop(ip, None)
+            self.entries[ip] = [time.time(), location]
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.entries)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+def make_session(pool_size=MAX_WORKERS, retries=RETRIES):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class OnlineLocator:
+    def __init__(self, url=GEO_URL, cache=None, session=None, timeout=TIMEOUT, max_workers=MAX_WORKERS):
+        self.url = url
+        self.cache = GeoCache() if cache is None else cache
+        self.session = session or make_session(max_workers)
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.lookups = 0
+        self.errors = 0
+
+    def fetch(self, ip):
+        self.lookups += 1
+        metrics.inc("lookups", provider="online")
+        # every failure is counted once, as errors{where="geolocate_fetch"}
+        with metrics.timed("geolocate_fetch"):
+            response = self.session.get(self.url.format(ip=ip), timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            if data.get("error") and not data.get("reserved"):
+                raise requests.RequestException(data.get("reason", "lookup failed"))
+        if data.get("error"):
+            return None
+        return location_from_response(ip, data)
+
+    def lookup(self, ip):
+        # None for private/reserved addresses, which never reach the network
+        if not is_public(ip):
+            return None
+        found, location = self.cache.get(ip)
+        if found:
+            return location
+        location = self.fetch(ip)
+        self.cache.put(ip, location)
+        return location
+
+    def _lookup_quiet(self, ip):
+        try:
+            return self.lookup(ip)
+        except (requests.RequestException, ValueError) as e:
+            self.errors += 1
+            return {"ip": ip, "error": str(e) or type(e).__name__}
+
+    def lookup_many(self, ips):
+        # results in the same order as ips; private addresses come back as
+        # None, failed lookups as {"ip": ip, "error": reason}
+        unique = list(dict.fromkeys(ips))
+        with metrics.timed("geolocate"), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = dict(zip(unique, pool.map(self._lookup_quiet, unique)))
+        self.save()
+        return [results[ip] for ip in ips]
+
+    def save(self):
+        self.cache.save()
+
+
+def _offline_locator(**kwargs):
+    import geooffline
+    return geooffline.OfflineLocator(**kwargs)
+
+
+PROVIDERS = {
+    "online": OnlineLocator,
+    "offline": _offline_locator,
+}
+
+
+def make_locator(provider=None, **kwargs):
+    provider = provider or GEO_PROVIDER
+    if provider not in PROVIDERS:
+        raise ValueError(f"unknown geolocation provider {provider!r}, choose from {', '.join(PROVIDERS)}")
+    return PROVIDERS[provider](**kwargs)
@@ -0,0 +1,300 @@
+import argparse
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import random
+import struct
+import time
+import geolocate
+import metrics
+
+# Offline geolocation from a CSV ip-range database. The CSV is loaded once
+# into sorted fixed-width arrays (big-endian range starts/ends plus a location
+# id per range) and saved as a binary index that later runs mmap directly,
+# so a lookup is just a binary search over the mapped file.
+#
+# The CSV needs a header row with either start_ip/end_ip (dotted or integer)
+# or a CIDR "network" column, plus any of the get_location() field names.
+# Nested or overlapping ranges are flattened into disjoint ones where the
+# more specific (later starting) range wins, so a /16 inside a /8 keeps its
+# own location and the rest of the /8 still resolves.
+
+DB_FILE = os.environ.get("VTRAC_GEO_DB", "ipdb.csv")
+INDEX_MAGIC = b"VTGEOIX1"
+INDEX_HEADER = struct.Struct("<8sIII")
+LOC_ID = struct.Struct("<I")
+
+START_COLUMNS = ("start_ip", "ip_start", "ip_from", "range_start")
+END_COLUMNS = ("end_ip", "ip_end", "ip_to", "range_end")
+ALIASES = {
+    "country": ("country", "country_name"),
+    "region": ("region", "region_name", "stateprov", "subdivision"),
+    "latitude": ("latitude", "lat"),
+    "longitude": ("longitude", "lon", "lng"),
+    "timezone": ("timezone", "time_zone"),
+    "org": ("org", "isp", "organization"),
+}
+
+
+def _parse_range(start, end):
+    # integer bounds are IPv6 when either of them is, so low IPv6 ranges
+    # (below 2**32) in integer-form databases are not mistaken for IPv4
+    start, end = start.strip(), end.strip()
+    if start.isdigit() and end.isdigit():
+        family = ipaddress.IPv4Address if max(int(start), int(end)) < 2 ** 32 else ipaddress.IPv6Address
+        return family(int(start)), family(int(end))
+    return _parse_ip(start, end), _parse_ip(end, start)
+
+
+def _parse_ip(value, other=""):
+    # one dotted/colon bound; an integer next to a textual bound follows its family
+    if value.isdigit():
+        number = int(value)
+        if number >= 2 ** 32 or ":" in other:
+            return ipaddress.IPv6Address(number)
+        return ipaddress.IPv4Address(number)
+    return ipaddress.ip_address(value)
+
+
+def _column(row, names):
+    for name in names:
+        if row.get(name) not in (None, ""):
+            return row[name]
+    return None
+
+
+def _location(row):
+    location = {}
+    for field in geolocate.FIELDS:
+        value = _column(row, ALIASES.get(field, (field,)))
+        if value is not None and field in ("latitude", "longitude", "country_area"):
+            try:
+                value = float(value)
+            except ValueError:
+                value = None
+        location[field] = value
+    return location
+
+
+def flatten(ranges):
+    # disjoint (start, end, loc_id) ranges from possibly nested integer ones;
+    # inside an enclosing range the one that starts later wins
+    flat = []
+    stack = []
+    pos = None
+
+    def emit(start, end, loc_id):
+        if start > end:
+            return
+        if flat and flat[-1][2] == loc_id and flat[-1][1] + 1 == start:
+            flat[-1] = (flat[-1][0], end, loc_id)
+        else:
+            flat.append((start, end, loc_id))
+
+    def close(before):
+        nonlocal pos
+        while stack and stack[-1][0] < before:
+            end, loc_id = stack.pop()
+            emit(pos, end, loc_id)
+            pos = max(pos, end + 1)
+
+    for start, end, loc_id in sorted(ranges, key=lambda r: (r[0], -r[1])):
+        close(start)
+        if stack:
+            emit(pos, start - 1, stack[-1][1])
+        stack.append((end, loc_id))
+        pos = start
+    close(float("inf"))
+    return flat
+
+
+def read_csv(path):
+    # returns ({4: [(start, end, loc_id)], 6: [...]}, locations) with packed,
+    # sorted and non-overlapping ranges
+    ranges = {4: [], 6: []}
+    locations = []
+    location_ids = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        header = {k.strip().lower() for k in reader.fieldnames or () if k}
+        if "network" not in header and not (header & set(START_COLUMNS) and header & set(END_COLUMNS)):
+            raise ValueError(f"{path} needs a network column or start/end ip columns "
+                             f"({', '.join(START_COLUMNS)} / {', '.join(END_COLUMNS)})")
+        for row in reader:
+            row = {k.strip().lower(): v for k, v in row.items() if k}
+            if row.get("network"):
+                network = ipaddress.ip_network(row["network"].strip(), strict=False)
+                start, end = network[0], network[-1]
+            else:
+                start, end = _column(row, START_COLUMNS), _column(row, END_COLUMNS)
+                if start is None or end is None:
+                    continue
+                start, end = _parse_range(start, end)
+            if start.version != end.version or start > end:
+                continue
+            location = _location(row)
+            key = json.dumps(location, sort_keys=True)
+            if key not in location_ids:
+                location_ids[key] = len(locations)
+                locations.append(location)
+            ranges[start.version].append((int(start), int(end), location_ids[key]))
+    for version, width in ((4, 4), (6, 16)):
+        ranges[version] = [(start.to_bytes(width, "big"), end.to_bytes(width, "big"), loc_id)
+                           for start, end, loc_id in flatten(ranges[version])]
+    return ranges, locations
+
+
+def write_index(ranges, locations, path):
+    # layout: header | v4 starts | v4 ends | v4 ids | v6 starts | v6 ends | v6 ids
+    #         | location offsets | location json records
+    records = [json.dumps(loc, separators=(",", ":")).encode() for loc in locations]
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(ranges[4]), len(ranges[6]), len(records)))
+        for version in (4, 6):
+            f.write(b"".join(r[0] for r in ranges[version]))
+            f.write(b"".join(r[1] for r in ranges[version]))
+            f.write(b"".join(LOC_ID.pack(r[2]) for r in ranges[version]))
+        f.write(b"".join(LOC_ID.pack(o) for o in offsets))
+        f.write(b"".join(records))
+    os.replace(tmp, path)
+
+
+class IntervalIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n4, n6, self.location_count = INDEX_HEADER.unpack_from(self.data)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a geolocation index")
+        off = INDEX_HEADER.size
+        self.tables = {}
+        for version, count, width in ((4, n4, 4), (6, n6, 16)):
+            self.tables[version] = (count, width, off, off + count * width, off + 2 * count * width)
+            off += count * (2 * width + LOC_ID.size)
+        self.offsets = off
+        self.records = off + (self.location_count + 1) * LOC_ID.size
+
+    def __len__(self):
+        return self.tables[4][0] + self.tables[6][0]
+
+    def find(self, ip):
+        # location dict of the range containing ip, or None
+        addr = ipaddress.ip_address(ip)
+        key = addr.packed
+        count, width, starts, ends, ids = self.tables[addr.version]
+        data = self.data
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[starts + mid * width:starts + (mid + 1) * width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        i = lo - 1
+        if data[ends + i * width:ends + (i + 1) * width] < key:
+            return None
+        return self.location(LOC_ID.unpack_from(data, ids + i * LOC_ID.size)[0])
+
+    def location(self, loc_id):
+        # location records are decoded on demand so opening the index stays instant
+        start, end = struct.unpack_from("<II", self.data, self.offsets + loc_id * LOC_ID.size)
+        return json.loads(self.data[self.records + start:self.records + end].decode())
+
+    def close(self):
+        self.data.close()
+
+
+def load_index(csv_path=DB_FILE, index_path=None):
+    # builds the binary index next to the CSV the first time, then just maps it
+    index_path = index_path or csv_path + ".idx"
+    if not os.path.exists(index_path) or (
+            os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(index_path)):
+        ranges, locations = read_csv(csv_path)
+        write_index(ranges, locations, index_path)
+    return IntervalIndex(index_path)
+
+
+class OfflineLocator:
+    def __init__(self, csv_path=DB_FILE, index_path=None):
+        self.index = load_index(csv_path, index_path)
+        self.lookups = 0
+
+    def lookup(self, ip):
+        if not geolocate.is_public(ip):
+            return None
+        self.lookups += 1
+        metrics.inc("lookups", provider="offline")
+        location = self.index.find(ip)
+        if location is None:
+            return None
+        return dict(ip=ip, **location)
+
+    def lookup_many(self, ips):
+        return [self.lookup(ip) for ip in ips]
+
+    def save(self):
+        pass
+
+
+def synthetic_csv(path, count, seed=1):
+    # random non-overlapping public ranges, for benchmarking without a real database
+    rng = random.Random(seed)
+    cities = [("Mumbai", "Maharashtra", "India", 19.07, 72.88, "Asia/Kolkata"),
+              ("Ashburn", "Virginia", "United States", 39.04, -77.49, "America/New_York"),
+              ("Frankfurt am Main", "Hesse", "Germany", 50.11, 8.68, "Europe/Berlin")]
+    v4 = sorted(rng.sample(range(0x01000000, 0xdf000000, 256), count))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["start_ip", "end_ip", "city", "region", "country", "latitude", "longitude",
+                         "timezone", "org"])
+        for i, start in enumerate(v4):
+            city = cities[i % len(cities)]
+            writer.writerow([start, start + 255] + list(city) + ["AS%d" % (i % 65536)])
+        for i in range(count // 4):
+            start = ipaddress.IPv6Address("2a00::") + (i << 64)
+            city = cities[i % len(cities)]
+            writer.writerow([str(start), str(start + (1 << 64) - 1)] + list(city) + ["AS%d" % i])
+    return v4
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and benchmark the offline geolocation index")
+    parser.add_argument("csv", nargs="?", default=DB_FILE)
+    parser.add_argument("--synthetic", type=int, default=0, help="write a synthetic CSV with this many ranges first")
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+    index_path = args.csv + ".idx"
+    if args.synthetic:
+        synthetic_csv(args.csv, args.synthetic)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    start = time.perf_counter()
+    ranges, locations = read_csv(args.csv)
+    write_index(ranges, locations, index_path)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    index = IntervalIndex(index_path)
+    load = time.perf_counter() - start
+    print(f"{len(index)} ranges, {index.location_count} locations")
+    print(f"build from CSV : {build * 1000:10.2f} ms")
+    print(f"index load     : {load * 1000:10.2f} ms")
+
+    rng = random.Random(2)
+    ips = [str(ipaddress.IPv4Address(rng.randrange(0x01000000, 0xdf000000))) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    hits = sum(1 for ip in ips if index.find(ip) is not None)
+    elapsed = time.perf_counter() - start
+    print(f"lookups        : {args.lookups / elapsed:10.0f} /s ({hits} hits)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import ipaddress
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for ipapi.co serving ipapi-shaped JSON at /<ip>/json/.
+# Answers are derived from the ip so repeated runs give the same data.
+
+CITIES = [
+    ("Mumbai", "Maharashtra", "India", "IN", 19.07, 72.88, "Asia/Kolkata", "+91"),
+    ("Ashburn", "Virginia", "United States", "US", 39.04, -77.49, "America/New_York", "+1"),
+    ("Frankfurt am Main", "Hesse", "Germany", "DE", 50.11, 8.68, "Europe/Berlin", "+49"),
+    ("Singapore", "Singapore", "Singapore", "SG", 1.29, 103.85, "Asia/Singapore", "+65"),
+]
+
+
+def fake_response(ip):
+    addr = ipaddress.ip_address(ip)
+    if not addr.is_global:
+        return {"ip": ip, "error": True, "reason": "Reserved IP Address", "reserved": True}
+    city, region, country, code, lat, lon, tz, calling = CITIES[zlib.crc32(ip.encode()) % len(CITIES)]
+    return {
+        "ip": ip,
+        "city": city,
+        "region": region,
+        "country": code,
+        "country_name": country,
+        "latitude": lat,
+        "longitude": lon,
+        "timezone": tz,
+        "country_calling_code": calling,
+        "country_area": 1000000.0,
+        "org": "AS%d Stub Networks" % (zlib.crc32(ip.encode()) % 65536),
+    }
+
+
+def make_handler(delay=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out as separate writes; without TCP_NODELAY
+        # Nagle holds the body until the client's delayed ACK (~40 ms)
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            try:
+                body = json.dumps(fake_response(parts[0])).encode()
+                status = 200
+            except ValueError:
+                body = json.dumps({"error": True, "reason": "Invalid IP Address"}).encode()
+                status = 400
+            if delay:
+                time.sleep(delay)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+def start(port=0, delay=0.0):
+    # runs the stub in a background thread; returns (server, url template)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/{ip}/json/" % server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ipapi.co stand-in")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.delay))
+    print("Serving on http://127.0.0.1:%d/{ip}/json/" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import collections
+import subprocess
+import threading
+import time
+import capture
+import metrics
+import stunextract
+
+# Continuous detection: a producer thread pushes captured frames into a
+# bounded ring buffer and a generator pipeline reports every new STUN peer
+# as soon as its first binding request is decoded.
+
+RING_SIZE = 4096
+MAX_PEERS = 4096
+METRICS_EVERY = 1024
+
+
+class RingBuffer:
+    def __init__(self, size=RING_SIZE):
+        self.items = collections.deque(maxlen=size)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item, block=False):
+        # live captures drop the oldest frame when full, replays wait instead
+        with self.cond:
+            while block and len(self.items) == self.items.maxlen and not self.closed:
+                self.cond.wait()
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+                metrics.inc("ring_overflow")
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+                if not self.items:
+                    return
+                item = self.items.popleft()
+                self.cond.notify_all()
+            yield item
+
+
+def capture_packets(interface="Wi-Fi", capture_filter=None, snaplen=None):
+    # live frames from tshark writing pcapng to stdout
+    cmd = ["tshark", "-i", interface, "-q", "-w", "-"]
+    if capture_filter:
+        cmd += ["-f", capture_filter]
+    if snaplen:
+        cmd += ["-s", str(snaplen)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield from stunextract.read_packets(proc.stdout)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def replay_packets(path, realtime=False):
+    # frames from a saved capture, at line rate or at the recorded timing
+    start = first = None
+    for ts, linktype, frame in stunextract.read_packets(path):
+        if realtime:
+            if first is None:
+                start, first = time.monotonic(), ts
+            delay = (ts - first) - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        yield ts, linktype, frame
+
+
+def start_producer(packets, ring, block=False):
+    def run():
+        try:
+            for ts, linktype, frame in packets:
+                ring.put((time.perf_counter(), ts, linktype, frame), block)
+        finally:
+            ring.close()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def new_peers(items, ip_address, max_peers=MAX_PEERS):
+    # yields (latency, ts, src, dst, attrs) the first time a peer is seen;
+    # the seen set is an LRU so memory stays flat however long it runs.
+    # Packet counts are kept locally and flushed to metrics every
+    # METRICS_EVERY packets, on each new peer and when the loop ends
+    seen = collections.OrderedDict()
+    counts = [0, 0]
+
+    def flush():
+        if counts[0]:
+            metrics.inc("packets_seen", counts[0])
+            metrics.inc("packets_kept", counts[1])
+            metrics.inc("packets_dropped", counts[0] - counts[1])
+            counts[0] = counts[1] = 0
+
+    try:
+        for arrival, ts, linktype, frame in items:
+            if counts[0] >= METRICS_EVERY:
+                flush()
+            counts[0] += 1
+            stun = stunextract.decode_frame(linktype, frame)
+            if stun is None or not stunextract.is_binding_to_peer(stun, ip_address):
+                continue
+            counts[1] += 1
+            peer = stun[1]
+            if peer in seen:
+                seen.move_to_end(peer)
+                continue
+            seen[peer] = ts
+            if len(seen) > max_peers:
+                seen.popitem(last=False)
+            flush()
+            yield time.perf_counter() - arrival, ts, stun[0], peer, stunextract.format_attrs(stun[6])
+    finally:
+        flush()
+
+
+def trace(packets, ip_address, on_peer, ring_size=RING_SIZE, max_peers=MAX_PEERS, block=False):
+    ring = RingBuffer(ring_size)
+    start_producer(packets, ring, block)
+    with metrics.profiled("live"):
+        for peer in new_peers(ring, ip_address, max_peers):
+            metrics.observe("peer_latency_seconds", peer[0])
+            on_peer(*peer)
+    return ring.dropped
+
+
+def print_peer(latency, ts, src, dst, attrs):
+    print(f"{src}\t{dst}\t{attrs}\t(+{latency * 1000:.2f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report STUN peers as they appear")
+    parser.add_argument("--replay", help="replay a saved capture instead of capturing live")
+    parser.add_argument("--realtime", action="store_true", help="replay at the recorded timing")
+    parser.add_argument("--interface", default="Wi-Fi")
+    parser.add_argument("--ip", default=None, help="own ip address to ignore as destination")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.replay:
+        packets = replay_packets(args.replay, args.realtime)
+    else:
+        packets = capture_packets(args.interface, capture.stun_filter(media=False), capture.SNAPLEN)
+    try:
+        dropped = trace(packets, args.ip, print_peer, block=bool(args.replay))
+    except KeyboardInterrupt:
+        return
+    if dropped:
+        print(f"{dropped} packets dropped by the ring buffer")
+
+
+if __name__ == "__main__":
+    main()
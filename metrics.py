@@ -0,0 +1,172 @@
+import atexit
+import cProfile
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight instrumentation: counters and timing histograms keyed by name
+# and labels, exported as JSON on exit (VTRAC_METRICS, "" to disable) and as
+# Prometheus text at /metrics in long-running mode. Setting VTRAC_PROFILE to
+# a file name runs the hot loops under cProfile and dumps the stats there.
+
+PREFIX = "vtrac_"
+METRICS_FILE = os.environ.get("VTRAC_METRICS", "vtrac_metrics.json")
+METRICS_PORT = int(os.environ.get("VTRAC_METRICS_PORT", "9477"))
+PROFILE_FILE = os.environ.get("VTRAC_PROFILE", "")
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "packets_seen": "Packets read from the capture",
+    "packets_kept": "Packets kept as STUN records",
+    "packets_dropped": "Packets discarded by the STUN filters",
+    "ring_overflow": "Live packets dropped because the ring buffer was full",
+    "lookups": "Geolocation lookups",
+    "cache_hits": "Geolocation cache hits",
+    "cache_misses": "Geolocation cache misses",
+    "errors": "Errors by where they happened",
+    "stage_seconds": "Time spent in each pipeline stage",
+    "peer_latency_seconds": "Delay between a live packet arriving and its peer being reported",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+        hist["count"] += 1
+        hist["sum"] += seconds
+        # buckets are cumulative like Prometheus "le" buckets
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+
+
+@contextlib.contextmanager
+def timed(stage, name="stage_seconds"):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("errors", where=stage)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, stage=stage)
+
+
+@contextlib.contextmanager
+def profiled(stage):
+    # cProfile around a hot loop when VTRAC_PROFILE is set, otherwise free
+    if not PROFILE_FILE:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        root, ext = os.path.splitext(PROFILE_FILE)
+        profile.dump_stats(f"{root}.{stage}{ext or '.prof'}")
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = []
+        for (name, labels), hist in sorted(_histograms.items()):
+            histograms.append({"name": name, "labels": dict(labels), "count": hist["count"], "sum": hist["sum"],
+                               "buckets": dict(zip(map(str, BUCKETS), hist["buckets"]))})
+    return {"counters": counters, "histograms": histograms}
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, dict(hist, buckets=list(hist["buckets"]))) for key, hist in _histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {PREFIX}{name}_total {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        lines.append(f"{PREFIX}{name}_total{_labels(labels)} {value}")
+    for (name, labels), hist in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for bound, count in zip(BUCKETS, hist["buckets"]):
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {hist['sum']}")
+        lines.append(f"{PREFIX}{name}_count{_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_json(path=None):
+    path = METRICS_FILE if path is None else path
+    if not path:
+        return
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def export_on_exit(path=None):
+    atexit.register(write_json, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host="127.0.0.1"):
+    # Prometheus endpoint at http://host:port/metrics in a background thread
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
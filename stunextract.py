@@ -0,0 +1,294 @@
+import os
+import socket
+import struct
+
+# Streaming pcap/pcapng reader that only decodes what we need to find STUN
+# peers: link layer -> IPv4/IPv6 -> UDP -> STUN header and attribute types.
+
+MAGIC_COOKIE = b"\x21\x12\xa4\x42"
+BINDING_METHOD = 0x001
+
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1000000),
+    b"\xa1\xb2\xc3\xd4": (">", 1000000),
+    b"\x4d\x3c\xb2\xa1": ("<", 1000000000),
+    b"\xa1\xb2\x3c\x4d": (">", 1000000000),
+}
+PCAPNG_SHB = b"\x0a\x0d\x0d\x0a"
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_RAW_OLD = 12
+LINKTYPE_LINUX_SLL = 113
+
+UDP_HEADER = struct.Struct(">HHHH")
+STUN_HEADER = struct.Struct(">HH4s12s")
+ATTR_HEADER = struct.Struct(">HH")
+
+CHUNK_SIZE = 1 << 20
+
+
+def read_packets(source, chunk_size=CHUNK_SIZE):
+    # yields (timestamp, linktype, frame) for every captured packet; source is
+    # a path, a binary file object or a list of paths read one after another
+    if isinstance(source, (list, tuple)):
+        for path in source:
+            yield from read_packets(path, chunk_size)
+        return
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb", buffering=chunk_size) as f:
+            yield from read_packets(f, chunk_size)
+        return
+    magic = source.read(4)
+    if len(magic) < 4:
+        return
+    if magic == PCAPNG_SHB:
+        yield from _read_pcapng(source, magic)
+    elif magic in PCAP_MAGICS:
+        yield from _read_pcap(source, magic)
+    else:
+        raise ValueError("not a pcap/pcapng capture")
+
+
+def _read_pcap(f, magic):
+    endian, resolution = PCAP_MAGICS[magic]
+    header = f.read(20)
+    if len(header) < 20:
+        return
+    linktype = struct.unpack(endian + "I", header[16:20])[0] & 0x0fffffff
+    yield from _pcap_records(f, endian, resolution, linktype)
+
+
+def _pcap_records(f, endian, resolution, linktype, limit=None):
+    record = struct.Struct(endian + "IIII")
+    read = f.read
+    pos = 0
+    while limit is None or pos < limit:
+        head = read(16)
+        if len(head) < 16:
+            return
+        sec, frac, caplen, _ = record.unpack(head)
+        frame = read(caplen)
+        if len(frame) < caplen:
+            return
+        pos += 16 + caplen
+        yield sec + frac / resolution, linktype, frame
+
+
+def _read_pcapng(f, magic, endian="<", interfaces=(), limit=None):
+    read = f.read
+    interfaces = list(interfaces)
+    head = magic + read(8)
+    pos = 0
+    while len(head) == 12:
+        if head[:4] == PCAPNG_SHB:
+            endian = "<" if head[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+        block_type, block_len = struct.unpack(endian + "II", head[:8])
+        body = read(block_len - 12)
+        if len(body) < block_len - 12:
+            return
+        body = head[8:] + body[:-4]
+        if block_type == 6:
+            iface, ts_high, ts_low, caplen = struct.unpack_from(endian + "IIII", body)
+            if iface < len(interfaces):
+                linktype, resolution = interfaces[iface]
+                yield ((ts_high << 32) | ts_low) / resolution, linktype, body[20:20 + caplen]
+        elif block_type == 3:
+            caplen = struct.unpack_from(endian + "I", body)[0]
+            if interfaces:
+                yield 0.0, interfaces[0][0], body[4:4 + caplen]
+        elif block_type == 1:
+            linktype = struct.unpack_from(endian + "H", body)[0]
+            interfaces.append((linktype, _tsresol(body[8:], endian)))
+        pos += block_len
+        if limit is not None and pos >= limit:
+            return
+        head = read(12)
+
+
+def plan_shards(path, shard_size):
+    # splits a capture into (start, end, state) byte ranges on record boundaries
+    # by walking only the record headers; state is what a reader needs to pick
+    # up mid-file (byte order, timestamp resolution, interface link types)
+    size = os.path.getsize(path)
+    shards = []
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if magic in PCAP_MAGICS:
+            endian, resolution = PCAP_MAGICS[magic]
+            header = f.read(20)
+            linktype = struct.unpack(endian + "I", header[16:20])[0] & 0x0fffffff
+            state = ("pcap", endian, resolution, linktype)
+            start = pos = 24
+            while pos + 16 <= size:
+                if pos - start >= shard_size:
+                    shards.append((start, pos, state))
+                    start = pos
+                f.seek(pos + 8)
+                pos += 16 + struct.unpack(endian + "I", f.read(4))[0]
+            shards.append((start, min(pos, size), state))
+        elif magic == PCAPNG_SHB:
+            endian = "<"
+            interfaces = []
+            start = pos = 0
+            state = ("pcapng", endian, ())
+            while pos + 12 <= size:
+                f.seek(pos)
+                head = f.read(12)
+                if head[:4] == PCAPNG_SHB:
+                    endian = "<" if head[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+                    interfaces = []
+                block_type, block_len = struct.unpack(endian + "II", head[:8])
+                if pos - start >= shard_size:
+                    shards.append((start, pos, state))
+                    start = pos
+                    state = ("pcapng", endian, tuple(interfaces))
+                if block_type == 1:
+                    body = head[8:] + f.read(block_len - 16)
+                    linktype = struct.unpack_from(endian + "H", body)[0]
+                    interfaces.append((linktype, _tsresol(body[8:], endian)))
+                if block_len < 12:
+                    break
+                pos += block_len
+            shards.append((start, min(pos, size), state))
+        else:
+            raise ValueError("not a pcap/pcapng capture")
+    return shards
+
+
+def read_shard(path, shard, chunk_size=CHUNK_SIZE):
+    # yields (timestamp, linktype, frame) for the records inside one planned shard
+    start, end, state = shard
+    with open(path, "rb", buffering=chunk_size) as f:
+        f.seek(start)
+        if state[0] == "pcap":
+            yield from _pcap_records(f, state[1], state[2], state[3], end - start)
+        else:
+            yield from _read_pcapng(f, f.read(4), state[1], state[2], end - start)
+
+
+def _tsresol(options, endian):
+    off = 0
+    while off + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, off)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[off + 4]
+            if value & 0x80:
+                return 2 ** (value & 0x7f)
+            return 10 ** value
+        off += 4 + ((length + 3) & ~3)
+    return 1000000
+
+
+def _network_offset(linktype, frame):
+    # returns (offset, ethertype) of the network header inside the frame
+    if linktype == LINKTYPE_ETHERNET:
+        off = 12
+        ethertype = frame[12] << 8 | frame[13]
+        while ethertype in (0x8100, 0x88a8) and len(frame) >= off + 8:
+            off += 4
+            ethertype = frame[off] << 8 | frame[off + 1]
+        return off + 2, ethertype
+    if linktype in (LINKTYPE_RAW, LINKTYPE_RAW_OLD):
+        version = frame[0] >> 4
+        return 0, 0x0800 if version == 4 else 0x86dd if version == 6 else 0
+    if linktype == LINKTYPE_LINUX_SLL:
+        return 16, frame[14] << 8 | frame[15]
+    if linktype == LINKTYPE_NULL:
+        family = struct.unpack("<I", frame[:4])[0]
+        if family > 0xffff:
+            family = struct.unpack(">I", frame[:4])[0]
+        return 4, 0x0800 if family == 2 else 0x86dd if family in (10, 24, 28, 30) else 0
+    return 0, 0
+
+
+def decode_udp(linktype, frame, sized=False):
+    # returns (src, dst, sport, dport, payload) for UDP frames, otherwise None;
+    # sized=True appends the payload size from the UDP length field, which
+    # stays right when a snaplen has truncated the payload itself
+    try:
+        off, ethertype = _network_offset(linktype, frame)
+        if ethertype == 0x0800:
+            if frame[off + 9] != 17 or frame[off + 6] & 0x1f or frame[off + 7]:
+                return None
+            src = socket.inet_ntop(socket.AF_INET, frame[off + 12:off + 16])
+            dst = socket.inet_ntop(socket.AF_INET, frame[off + 16:off + 20])
+            off += (frame[off] & 0x0f) * 4
+        elif ethertype == 0x86dd:
+            if frame[off + 6] != 17:
+                return None
+            src = socket.inet_ntop(socket.AF_INET6, frame[off + 8:off + 24])
+            dst = socket.inet_ntop(socket.AF_INET6, frame[off + 24:off + 40])
+            off += 40
+        else:
+            return None
+        sport, dport, length, _ = UDP_HEADER.unpack_from(frame, off)
+    except (IndexError, struct.error, ValueError):
+        return None
+    if sized:
+        return src, dst, sport, dport, frame[off + 8:off + length], max(length - 8, 0)
+    return src, dst, sport, dport, frame[off + 8:off + length]
+
+
+def decode_stun(payload):
+    # returns (msg_type, transaction_id, attribute_types) or None; frames cut
+    # by a capture snaplen only report the attributes that were captured
+    if len(payload) < 20 or payload[0] & 0xc0 or payload[4:8] != MAGIC_COOKIE:
+        return None
+    msg_type, length, _, txid = STUN_HEADER.unpack_from(payload)
+    if length & 3:
+        return None
+    attrs = []
+    off = 20
+    end = min(20 + length, len(payload))
+    while off + 4 <= end:
+        attr_type, attr_len = ATTR_HEADER.unpack_from(payload, off)
+        attrs.append(attr_type)
+        off += 4 + ((attr_len + 3) & ~3)
+    return msg_type, txid, attrs
+
+
+def stun_method(msg_type):
+    return (msg_type & 0x000f) | ((msg_type & 0x00e0) >> 1) | ((msg_type & 0x3e00) >> 2)
+
+
+def decode_frame(linktype, frame):
+    # returns (src, dst, sport, dport, msg_type, txid, attrs) for STUN frames
+    udp = decode_udp(linktype, frame)
+    if udp is None:
+        return None
+    stun = decode_stun(udp[4])
+    if stun is None:
+        return None
+    return udp[:4] + stun
+
+
+def iter_stun(source):
+    # yields (timestamp, src, dst, sport, dport, msg_type, txid, attrs)
+    for ts, linktype, frame in read_packets(source):
+        stun = decode_frame(linktype, frame)
+        if stun is not None:
+            yield (ts,) + stun
+
+
+def is_binding_to_peer(stun, ip_address):
+    return stun_method(stun[4]) == BINDING_METHOD and stun[1] != ip_address
+
+
+def format_attrs(attrs):
+    return ",".join("0x%04x" % a for a in attrs)
+
+
+def extract_binding_requests(source, ip_address=None):
+    # single pass equivalent of the old tshark chain:
+    #   -Y stun.type.method==0x001 | -Y ip.dst!=ip_address | sort /unique
+    found = set()
+    for stun in iter_stun(source):
+        if is_binding_to_peer(stun[1:], ip_address):
+            found.add((stun[1], stun[2], format_attrs(stun[7])))
+    return sorted(found)
+
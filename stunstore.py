@@ -0,0 +1,224 @@
+import argparse
+import array
+import os
+import socket
+import struct
+import sys
+import time
+import metrics
+import stunextract
+
+# Columnar store for extracted STUN records, so views and peer listings are
+# answered without rescanning the capture. Every column is a typed array:
+#   ts (float64), src/dst (ids into a table of packed 16-byte ips, IPv4 as
+#   ::ffff:a.b.c.d), sport/dport/type (uint16), attribute codes (uint16)
+#   addressed through per-record offsets (uint32).
+# Two small indexes are stored alongside: record ids per ip, and record ids
+# sorted by timestamp.
+
+STORE_FILE = "packets.stun"
+MAGIC = b"VTSTUN01"
+HEADER = struct.Struct("<8sIIII")
+V4_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+def pack_ip(ip):
+    if ":" in ip:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    return V4_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+
+
+def unpack_ip(packed):
+    if packed[:12] == V4_PREFIX:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class RecordWriter:
+    def __init__(self):
+        self.ts = array.array("d")
+        self.src = array.array("I")
+        self.dst = array.array("I")
+        self.sport = array.array("H")
+        self.dport = array.array("H")
+        self.type = array.array("H")
+        self.attr_offsets = array.array("I", [0])
+        self.attrs = array.array("H")
+        self.ip_ids = {}
+
+    def _ip_id(self, ip):
+        ip_id = self.ip_ids.get(ip)
+        if ip_id is None:
+            ip_id = self.ip_ids[ip] = len(self.ip_ids)
+        return ip_id
+
+    def add(self, ts, src, dst, sport, dport, msg_type, txid, attrs):
+        self.ts.append(ts)
+        self.src.append(self._ip_id(src))
+        self.dst.append(self._ip_id(dst))
+        self.sport.append(sport)
+        self.dport.append(dport)
+        self.type.append(msg_type)
+        self.attrs.extend(attrs)
+        self.attr_offsets.append(len(self.attrs))
+
+    def write(self, path):
+        ips = sorted(self.ip_ids, key=self.ip_ids.get)
+        postings = [[] for _ in ips]
+        for i, (src, dst) in enumerate(zip(self.src, self.dst)):
+            postings[src].append(i)
+            if dst != src:
+                postings[dst].append(i)
+        ip_offsets = array.array("I", [0])
+        ip_postings = array.array("I")
+        for ids in postings:
+            ip_postings.extend(ids)
+            ip_offsets.append(len(ip_postings))
+        by_time = array.array("I", sorted(range(len(self.ts)), key=self.ts.__getitem__))
+        columns = [self.ts, self.src, self.dst, self.sport, self.dport, self.type,
+                   self.attr_offsets, self.attrs, ip_offsets, ip_postings, by_time]
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.ts), len(ips), len(self.attrs), len(ip_postings)))
+            f.write(b"".join(pack_ip(ip) for ip in ips))
+            for column in columns:
+                if sys.byteorder == "big":
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+        os.replace(tmp, path)
+
+
+def build(source, path=STORE_FILE, correlator=None):
+    # one pass over the capture; an optional correlate.Correlator is fed the
+    # same frames so peer ranking needs no second pass
+    writer = RecordWriter()
+    seen = 0
+    with metrics.timed("parse"), metrics.profiled("parse"):
+        for ts, linktype, frame in stunextract.read_packets(source):
+            seen += 1
+            udp = stunextract.decode_udp(linktype, frame, sized=True)
+            if udp is None:
+                continue
+            if correlator is not None:
+                correlator.feed(ts, *udp)
+            stun = stunextract.decode_stun(udp[4])
+            if stun is not None:
+                writer.add(ts, *udp[:4], *stun)
+    metrics.inc("packets_seen", seen)
+    metrics.inc("packets_kept", len(writer.ts))
+    metrics.inc("packets_dropped", seen - len(writer.ts))
+    writer.write(path)
+    return RecordStore(path)
+
+
+class RecordStore:
+    def __init__(self, path=STORE_FILE):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, n, k, n_attrs, n_postings = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a STUN record store")
+        off = HEADER.size
+        self.ips = [unpack_ip(data[off + i * 16:off + (i + 1) * 16]) for i in range(k)]
+        off += 16 * k
+        layout = [("ts", "d", n), ("src", "I", n), ("dst", "I", n), ("sport", "H", n), ("dport", "H", n),
+                  ("type", "H", n), ("attr_offsets", "I", n + 1), ("attrs", "H", n_attrs),
+                  ("ip_offsets", "I", k + 1), ("ip_postings", "I", n_postings), ("by_time", "I", n)]
+        for name, typecode, count in layout:
+            column = array.array(typecode)
+            column.frombytes(data[off:off + count * column.itemsize])
+            if sys.byteorder == "big":
+                column.byteswap()
+            setattr(self, name, column)
+            off += count * column.itemsize
+        self.ip_ids = {ip: i for i, ip in enumerate(self.ips)}
+
+    def __len__(self):
+        return len(self.ts)
+
+    def attributes(self, i):
+        return self.attrs[self.attr_offsets[i]:self.attr_offsets[i + 1]]
+
+    def record(self, i):
+        return (self.ts[i], self.ips[self.src[i]], self.ips[self.dst[i]], self.sport[i], self.dport[i],
+                self.type[i], list(self.attributes(i)))
+
+    def row(self, i):
+        # (src, dst, attributes) as the old tshark -T fields view printed them
+        return self.ips[self.src[i]], self.ips[self.dst[i]], stunextract.format_attrs(self.attributes(i))
+
+    def with_ip(self, ip):
+        ip_id = self.ip_ids.get(ip)
+        if ip_id is None:
+            return []
+        return self.ip_postings[self.ip_offsets[ip_id]:self.ip_offsets[ip_id + 1]].tolist()
+
+    def between(self, start=None, end=None):
+        # record ids with start <= ts <= end, in time order
+        lo, hi = 0, len(self.by_time)
+        if start is not None:
+            lo = self._time_bisect(start, False)
+        if end is not None:
+            hi = self._time_bisect(end, True)
+        return self.by_time[lo:hi].tolist()
+
+    def _time_bisect(self, value, right):
+        lo, hi = 0, len(self.by_time)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ts = self.ts[self.by_time[mid]]
+            if ts < value or (right and ts == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def binding_requests(self, ip_address=None):
+        # same rows stunextract.extract_binding_requests() gives for the capture
+        own = self.ip_ids.get(ip_address, -1)
+        found = set()
+        for i, msg_type in enumerate(self.type):
+            if stunextract.stun_method(msg_type) == stunextract.BINDING_METHOD and self.dst[i] != own:
+                found.add(self.row(i))
+        return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the columnar STUN record store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("build", help="extract STUN records from a capture")
+    p.add_argument("capture")
+    p.add_argument("store", nargs="?", default=STORE_FILE)
+    p = sub.add_parser("view", help="print records from a store")
+    p.add_argument("store", nargs="?", default=STORE_FILE)
+    p.add_argument("--ip", help="only records to or from this ip")
+    p.add_argument("--start", type=float, help="only records at or after this timestamp")
+    p.add_argument("--end", type=float, help="only records at or before this timestamp")
+    p.add_argument("--binding", metavar="OWN_IP", nargs="?", const="",
+                   help="list unique binding requests not sent to OWN_IP")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        store = build(args.capture, args.store)
+        print(f"{len(store)} STUN records, {len(store.ips)} ips -> {args.store} "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return
+    store = RecordStore(args.store)
+    if args.binding is not None:
+        rows = store.binding_requests(args.binding or None)
+    else:
+        ids = store.between(args.start, args.end)
+        if args.ip:
+            wanted = set(store.with_ip(args.ip))
+            ids = [i for i in ids if i in wanted]
+        rows = [store.row(i) for i in ids]
+    elapsed = time.perf_counter() - start
+    for row in rows:
+        print("\t".join(row))
+    print(f"{len(rows)} rows in {elapsed * 1000:.2f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import ipaddress
+import os
+import random
+import struct
+import capture
+import stunextract
+
+# Synthetic VoIP captures for benchmarking. The STUN binding request, TURN
+# allocate, Ethernet header and background (non-STUN) frames all come from
+# the checked-in sample captures; only addresses, ports, transaction ids and
+# timestamps are rewritten, plus RTP-like media between the call endpoints.
+
+TEMPLATES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                  for name in ("packets.pcap", "packets1.pcap"))
+PUBLIC_V4_FIRST_OCTETS = (23, 31, 34, 52, 54, 104, 142, 157, 185)
+MEDIA_INTERVAL = 0.02
+
+
+def load_templates(paths=TEMPLATES):
+    templates = {"binding": None, "allocate": None, "ethernet": None, "background": []}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for ts, linktype, frame in stunextract.read_packets(path):
+            if linktype != stunextract.LINKTYPE_ETHERNET:
+                continue
+            if templates["ethernet"] is None:
+                templates["ethernet"] = frame[:12]
+            udp = stunextract.decode_udp(linktype, frame)
+            stun = stunextract.decode_stun(udp[4]) if udp else None
+            if stun is None:
+                templates["background"].append(frame)
+                continue
+            method = stunextract.stun_method(stun[0])
+            cls = stun[0] & 0x0110
+            if cls == 0 and method == stunextract.BINDING_METHOD and templates["binding"] is None:
+                templates["binding"] = udp[4]
+            elif cls == 0 and method == 0x003 and templates["allocate"] is None:
+                templates["allocate"] = udp[4]
+    if templates["binding"] is None:
+        raise ValueError("no STUN binding request found in the template captures")
+    if templates["ethernet"] is None:
+        templates["ethernet"] = b"\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02"
+    if templates["allocate"] is None:
+        templates["allocate"] = struct.pack(">HH", 0x0003, 0) + templates["binding"][4:20]
+    return templates
+
+
+def _checksum(header):
+    total = sum(struct.unpack(">10H", header))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def udp_frame(ethernet, src, dst, sport, dport, payload):
+    # Ethernet/IP/UDP frame around payload (UDP checksum left at zero)
+    udp = struct.pack(">HHHH", sport, dport, 8 + len(payload), 0) + payload
+    if ":" in src:
+        ip = struct.pack(">IHBB", 6 << 28, len(udp), 17, 64)
+        ip += ipaddress.IPv6Address(src).packed + ipaddress.IPv6Address(dst).packed
+        return ethernet + b"\x86\xdd" + ip + udp
+    header = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                         ipaddress.IPv4Address(src).packed, ipaddress.IPv4Address(dst).packed)
+    header = header[:10] + struct.pack(">H", _checksum(header)) + header[12:]
+    return ethernet + b"\x08\x00" + header + udp
+
+
+def stun_message(template, rng, msg_type=None, txid=None):
+    msg_type = struct.unpack_from(">H", template)[0] if msg_type is None else msg_type
+    txid = txid or bytes(rng.getrandbits(8) for _ in range(12))
+    return struct.pack(">H", msg_type) + template[2:8] + txid + template[20:]
+
+
+def public_ip(rng, v6=False):
+    while True:
+        if v6:
+            ip = str(ipaddress.IPv6Address((0x2a03 << 112) | rng.getrandbits(112)))
+        else:
+            ip = "%d.%d.%d.%d" % (rng.choice(PUBLIC_V4_FIRST_OCTETS), rng.randrange(256),
+                                  rng.randrange(256), rng.randrange(1, 255))
+        if ipaddress.ip_address(ip).is_global:
+            return ip
+
+
+def generate(calls=10, stun_servers=2, lan_candidates=1, turn_ratio=0.3, media_packets=250,
+             background_ratio=0.5, ipv6_ratio=0.0, seed=1, templates=None):
+    # yields (ts, linktype, frame) in time order
+    rng = random.Random(seed)
+    templates = templates or load_templates()
+    eth = templates["ethernet"]
+    events = []
+    start = 1700000000.0
+    servers_v4 = [public_ip(rng) for _ in range(max(stun_servers, 1))]
+    servers_v6 = [public_ip(rng, True) for _ in range(max(stun_servers, 1))]
+    for call in range(calls):
+        v6 = rng.random() < ipv6_ratio
+        local = public_ip(rng, True) if v6 else "192.168.%d.%d" % (rng.randrange(256), rng.randrange(1, 255))
+        peer = public_ip(rng, v6)
+        lport, pport = rng.randrange(49152, 65535), rng.randrange(49152, 65535)
+        t = start + call * 1.5 + rng.random()
+        relayed = rng.random() < turn_ratio
+        for server in (servers_v6 if v6 else servers_v4)[:stun_servers]:
+            txid = bytes(rng.getrandbits(8) for _ in range(12))
+            events.append((t, udp_frame(eth, local, server, lport, 3478,
+                                        stun_message(templates["binding"], rng, txid=txid))))
+            events.append((t + 0.03, udp_frame(eth, server, local, 3478, lport,
+                                               stun_message(templates["binding"], rng, 0x0101, txid))))
+        for _ in range(lan_candidates if not v6 else 0):
+            lan = "10.%d.%d.%d" % (rng.randrange(256), rng.randrange(256), rng.randrange(1, 255))
+            events.append((t + 0.05, udp_frame(eth, local, lan, lport, rng.randrange(49152, 65535),
+                                               stun_message(templates["binding"], rng))))
+        if relayed:
+            relay = public_ip(rng, v6)
+            txid = bytes(rng.getrandbits(8) for _ in range(12))
+            events.append((t + 0.06, udp_frame(eth, local, relay, lport, 3478,
+                                               stun_message(templates["allocate"], rng, txid=txid))))
+            events.append((t + 0.1, udp_frame(eth, relay, local, 3478, lport,
+                                              stun_message(templates["allocate"], rng, 0x0103, txid))))
+            media_ip, media_port, media = relay, 3478, b"\x40\x00\x00\xa0" + bytes(160)
+        else:
+            media_ip, media_port = peer, pport
+            media = b"\x80\x00" + bytes(170)
+        txid = bytes(rng.getrandbits(8) for _ in range(12))
+        events.append((t + 0.1, udp_frame(eth, local, media_ip, lport, media_port,
+                                          stun_message(templates["binding"], rng, txid=txid))))
+        events.append((t + 0.14, udp_frame(eth, media_ip, local, media_port, lport,
+                                           stun_message(templates["binding"], rng, 0x0101, txid))))
+        for i in range(media_packets):
+            ts = t + 0.2 + i * MEDIA_INTERVAL / 2
+            if i % 2:
+                events.append((ts, udp_frame(eth, media_ip, local, media_port, lport, media)))
+            else:
+                events.append((ts, udp_frame(eth, local, media_ip, lport, media_port, media)))
+    background = templates["background"]
+    if background and background_ratio > 0:
+        count = int(len(events) * background_ratio / (1 - background_ratio)) if background_ratio < 1 else len(events)
+        end = max(ts for ts, _ in events)
+        for _ in range(count):
+            events.append((rng.uniform(start, end), rng.choice(background)))
+    events.sort(key=lambda event: event[0])
+    for ts, frame in events:
+        yield ts, stunextract.LINKTYPE_ETHERNET, frame
+
+
+def write(path, **kwargs):
+    return capture.write_pcap(path, generate(**kwargs), snaplen=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic VoIP/STUN capture")
+    parser.add_argument("output")
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--stun-servers", type=int, default=2)
+    parser.add_argument("--lan-candidates", type=int, default=1)
+    parser.add_argument("--turn-ratio", type=float, default=0.3, help="share of calls relayed through TURN")
+    parser.add_argument("--media-packets", type=int, default=250, help="media packets per call")
+    parser.add_argument("--background-ratio", type=float, default=0.5, help="share of non-VoIP packets")
+    parser.add_argument("--ipv6-ratio", type=float, default=0.0, help="share of calls over IPv6")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    size = write(args.output, calls=args.calls, stun_servers=args.stun_servers, lan_candidates=args.lan_candidates,
+                 turn_ratio=args.turn_ratio, media_packets=args.media_packets,
+                 background_ratio=args.background_ratio, ipv6_ratio=args.ipv6_ratio, seed=args.seed)
+    print(f"{args.output}: {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,65 @@
 import os
 import socket
-import requests
+import subprocess
+import geolocate
 import shutil
+import stunstore
+import livetrace
+import correlate
+import capture
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 clear="cls"
+locator = geolocate.make_locator()
 def get_location(arg1):
     ip_address = arg1
-    response = requests.get(f'https://ipapi.co/{ip_address}/json/').json()
-    location_data = {
-        "ip": ip_address,
-        "city": response.get("city"),
-        "region": response.get("region"),
-        "country": response.get("country_name"),
-        "latitude": response.get("latitude"),
-        "longitude": response.get("longitude"),
-        "country_area": response.get("country_area"),
-        "timezone": response.get("timezone"),
-        "country_calling_code": response.get("country_calling_code"),
-        "org": response.get("org")
-    }
-    return location_data
+    with metrics.timed("get_location"):
+        return locator.lookup(ip_address)
 def tshark(sec):
-    cmd = f"tshark -i Wi-Fi -w packets.pcap -a duration:{sec}"
-    os.system(cmd)
+    for old in capture.ring_files("packets.pcap"):
+        if old != "packets.pcap":
+            os.remove(old)
+    cmd = capture.capture_command("Wi-Fi", "packets.pcap", sec, capture.stun_filter())
+    with metrics.timed("capture"):
+        subprocess.run(cmd)
     print("\nFiltered Binding Request STUN Packets after scanning:\n\nSrc\t\t\t\tDest\t\t\tAttr Val")
-    cmd = f"tshark -Y stun.type.method==0x001 -T fields -e ip.src -e ip.dst -e stun.attribute -r packets.pcap -w packets1.pcap"
-    os.system(cmd)
-    cmd = f"tshark -Y ip.dst!={ip_address} -T fields -e ip.src -e ip.dst -e stun.attribute -r packets1.pcap -w filteredPackets.pcap | sort /unique > filteredPackets.txt"
-    os.system(cmd)
+    correlator = correlate.Correlator([ip_address])
+    files = capture.ring_files("packets.pcap")
+    lost = capture.lost_ring_files(files)
+    if lost:
+        print(f"\nWarning: the first {lost} ring file(s) were deleted, packets from the start of the scan are missing")
+    with metrics.timed("extract"):
+        store = stunstore.build(files, "packets.stun", correlator)
+        records = store.binding_requests(ip_address)
+    for record in records:
+        print("\t".join(record))
+    return store, records, correlator.peers()
+def live_tracing():
+    pool = ThreadPoolExecutor(max_workers=4)
+    def show_location(future):
+        try:
+            details = future.result()
+        except Exception as e:
+            print("Lookup failed: "+str(e))
+            return
+        if not details:
+            return
+        print("\t"+str(details["ip"])+" : "+", ".join(str(details[k]) for k in ("city", "region", "country", "org")))
+    def on_peer(latency, ts, src, dst, attrs):
+        print(src+"\t\t"+dst+"\t\t"+attrs+"\t(+%.2f ms)" % (latency*1000))
+        pool.submit(get_location, dst).add_done_callback(show_location)
+    try:
+        metrics.serve()
+    except OSError as e:
+        print("Metrics endpoint not started: "+str(e))
+    print("\nLive STUN Peers (Press Ctrl+C to stop):\n\nSrc\t\t\t\tDest\t\t\tAttr Val")
+    try:
+        livetrace.trace(livetrace.capture_packets("Wi-Fi", capture.stun_filter(media=False), capture.SNAPLEN), ip_address, on_peer)
+    except KeyboardInterrupt:
+        pass
+    # lookups still in flight finish (and print) before the cache is saved
+    pool.shutdown(wait=True)
+    locator.save()
 def Intro():
     os.system(clear)
     '''
@@ -41,6 +74,8 @@ def Intro():
     print()
     print("Tool under development - Only for Testing Purpose\n\n".center(shutil.get_terminal_size().columns))
 
+metrics.export_on_exit()
+
 #getting host ip
 hostname=socket.gethostname()
 ip_address=socket.gethostbyname(hostname)
@@ -48,41 +83,37 @@ ip_address=socket.gethostbyname(hostname)
 #start tracing
 Intro()
 print("[1]Start Tracing")
+print("[2]Live Tracing")
 opt=int(input())
 if opt==1:
     sec=int(input("Enter the Duration of the Scanning(in secs): "))
-    tshark(sec)
+    store, packets, ranked = tshark(sec)
     ch=input("\nWant to view all captured STUN Packets (y/n): ")
-    filtFile = open("filteredPackets.txt", "r")
-    packets = []
-    try:
-        for packet in filtFile.readlines():
-            packets.append(packet.split())
-    except:
-        pass
     if packets:
         if ch=="y" or ch=="Y":
             Intro()
             print("\tAll VoIP Packets that have been captured\n\nSrc\t\tDest\t\tAttr Val\n---------------------------------------------------------------------------")
-            cmd="tshark -Y stun -T fields -e ip.src -e ip.dst -e stun.attribute -r packets.pcap"
-            os.system(cmd)
+            for i in range(len(store)):
+                print("\t".join(store.row(i)))
             buff=input("\n\tPress Enter to Continue")
 
         print("\n\n\t\t\tLoading....")
 
-        if len(packets)>2:
-            print("Warning: More than one users found in VoIP calling!, So just ignoring the other Packets other than 1st.")
         found_ip=[]
+        roles=[]
+        for peer in ranked:
+            found_ip.append(peer["ip"])
+            roles.append(peer["role"]+", "+str(peer["media_packets"])+" media packets, %.1fs" % peer["duration"])
         for packet in packets:
-            found_ip.append(packet[1])
-        details=[]
-        for ip in found_ip:
-            details.append(get_location(ip))
+            if packet[1] not in found_ip:
+                found_ip.append(packet[1])
+                roles.append("binding request only")
+        details=locator.lookup_many(found_ip)
         while True:
             Intro()
-            print("\nObtained IP:\n")
+            print("\nObtained IP (most likely call peer first):\n")
             for i in range(len(found_ip)):
-                print("["+str(i+1)+"] "+str(found_ip[i]))
+                print("["+str(i+1)+"] "+str(found_ip[i])+"\t("+roles[i]+")")
             ipch=input("\nSelect ip for More Details\nPress 'q' to quit\n")
             if ipch=='q':
                 break
@@ -94,7 +125,9 @@ if opt==1:
             if n <1 or n>len(found_ip):
                 print("wrong Choice!! try Again")
             else:
-                if details[n-1]:
+                if details[n-1] and "error" in details[n-1]:
+                    print("Lookup failed: "+str(details[n-1]["error"]))
+                elif details[n-1]:
                     Intro()
                     print("\t\tRetrieved Details of ["+str(n)+"]\n")
                     for data in details[n-1]:
@@ -102,4 +135,6 @@ if opt==1:
                 else:
                     print("Private IP!! - No Data Retrieved")
 
-            buff=input("\n\tPress Enter to go back to IP Menu")
\ No newline at end of file
+            buff=input("\n\tPress Enter to go back to IP Menu")
+elif opt==2:
+    live_tracing()